@@ -0,0 +1,52 @@
+"""
+Analysis Cache Helpers
+
+Caches parsed vision analyses keyed by the SHA-256 of the image bytes, so
+re-uploads of the same photo skip the upstream vision call.
+Uses Redis when REDIS_URL is set, otherwise an in-process TTL cache.
+"""
+
+import asyncio
+from typing import Optional
+
+import orjson
+from cachetools import TTLCache
+
+from config import settings
+
+REDIS_TTL_SECONDS = 86400
+
+_redis = None
+_local_cache = TTLCache(maxsize=1024, ttl=3600)
+_local_lock = asyncio.Lock()
+
+if settings().redis_url:
+    from redis import asyncio as aioredis
+    _redis = aioredis.from_url(settings().redis_url)
+
+def _key(digest: str) -> str:
+    return f"vision:{digest}"
+
+async def get_cached_analysis(digest: str) -> Optional[dict]:
+    """Return a cached analysis for this image hash, or None on miss/cache error"""
+    if _redis is not None:
+        try:
+            cached = await _redis.get(_key(digest))
+        except Exception:
+            return None
+        return orjson.loads(cached) if cached else None
+
+    async with _local_lock:
+        return _local_cache.get(_key(digest))
+
+async def set_cached_analysis(digest: str, analysis: dict):
+    """Store an analysis for this image hash; cache errors are ignored"""
+    if _redis is not None:
+        try:
+            await _redis.setex(_key(digest), REDIS_TTL_SECONDS, orjson.dumps(analysis))
+        except Exception:
+            pass
+        return
+
+    async with _local_lock:
+        _local_cache[_key(digest)] = analysis
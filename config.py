@@ -0,0 +1,43 @@
+"""
+Application Settings
+
+Environment configuration read once and frozen. .env is loaded when this module
+is imported; `settings()` parses and validates the environment on its first call
+and caches the result. The app modules (database, cache, main) call it at import
+time, so bad values fail when the app is imported instead of on a request.
+"""
+
+import os
+from dataclasses import dataclass
+from functools import cache
+from typing import Optional
+
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+@dataclass(frozen=True)
+class Settings:
+    database_url: Optional[str]
+    database_name: Optional[str]
+    redis_url: Optional[str]
+    openai_api_url: str
+    openai_api_key: Optional[str]
+    openai_max_concurrency: int
+    max_upload_mb: int
+    port: int
+
+@cache
+def settings() -> Settings:
+    """Settings from the environment, parsed on first call and cached"""
+    return Settings(
+        database_url=os.getenv("DATABASE_URL"),
+        database_name=os.getenv("DATABASE_NAME"),
+        redis_url=os.getenv("REDIS_URL"),
+        openai_api_url=os.getenv("OPENAI_API_URL", "https://api.openai.com/v1/chat/completions"),
+        openai_api_key=os.getenv("OPENAI_API_KEY"),
+        openai_max_concurrency=int(os.getenv("OPENAI_MAX_CONCURRENCY", "8")),
+        max_upload_mb=int(os.getenv("MAX_UPLOAD_MB", "10")),
+        port=int(os.getenv("PORT", "8000")),
+    )
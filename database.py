@@ -5,51 +5,107 @@ MongoDB helper functions ready to use in your backend code.
 Import and use these functions in your API endpoints for database operations.
 """
 
-from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
+from bson import ObjectId
+from bson.errors import InvalidId
 from datetime import datetime, timezone
-import os
-from dotenv import load_dotenv
-from typing import Union
+from typing import List, Tuple, Union
 from pydantic import BaseModel
-
-# Load environment variables from .env file
-load_dotenv()
+from config import settings
 
 _client = None
 db = None
 
-database_url = os.getenv("DATABASE_URL")
-database_name = os.getenv("DATABASE_NAME")
+if settings().database_url and settings().database_name:
+    _client = AsyncIOMotorClient(settings().database_url, maxPoolSize=50)
+    db = _client[settings().database_name]
+
+# Indexes backing the hot queries; create_index is a no-op when they already exist
+INDEXES = {
+    # Email uniqueness is enforced by the database, not by a pre-insert lookup
+    "user": [([("email", 1)], {"unique": True})],
+    # Back meal listings newest first, by user and unfiltered, so Mongo stops after `limit` docs
+    "meal": [
+        ([("user_id", 1), ("created_at", -1)], {}),
+        ([("created_at", -1)], {}),
+    ],
+}
+
+async def ensure_indexes():
+    """Create the indexes in INDEXES; call once at startup"""
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
 
-if database_url and database_name:
-    _client = MongoClient(database_url)
-    db = _client[database_name]
+    for collection_name, indexes in INDEXES.items():
+        for keys, options in indexes:
+            await db[collection_name].create_index(keys, **options)
 
 # Helper functions for common database operations
-def create_document(collection_name: str, data: Union[BaseModel, dict]):
+async def create_document(collection_name: str, data: Union[BaseModel, dict]):
     """Insert a single document with timestamp"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
 
-    # Convert Pydantic model to dict if needed
+    # Convert Pydantic model to dict if needed (JSON-safe types, None fields omitted)
     if isinstance(data, BaseModel):
-        data_dict = data.model_dump()
+        data_dict = data.model_dump(mode="json", exclude_none=True)
     else:
         data_dict = data.copy()
 
     data_dict['created_at'] = datetime.now(timezone.utc)
     data_dict['updated_at'] = datetime.now(timezone.utc)
 
-    result = db[collection_name].insert_one(data_dict)
+    result = await db[collection_name].insert_one(data_dict)
     return str(result.inserted_id)
 
-def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
-    """Get documents from collection"""
+async def get_document(collection_name: str, document_id: str, projection: dict = None):
+    """Get a single document by its ObjectId string, or None if missing/invalid"""
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    try:
+        object_id = ObjectId(document_id)
+    except InvalidId:
+        return None
+    return await db[collection_name].find_one({"_id": object_id}, projection)
+
+async def update_document(collection_name: str, document_id: str, update_dict: dict):
+    """Set fields on a single document by its ObjectId string, refreshing updated_at"""
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    data_dict = update_dict.copy()
+    data_dict['updated_at'] = datetime.now(timezone.utc)
+
+    result = await db[collection_name].update_one({"_id": ObjectId(document_id)}, {"$set": data_dict})
+    return result.modified_count > 0
+
+async def update_documents(collection_name: str, filter_dict: dict, update_dict: dict):
+    """Set fields on every document matching the filter, refreshing updated_at"""
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    data_dict = update_dict.copy()
+    data_dict['updated_at'] = datetime.now(timezone.utc)
+
+    result = await db[collection_name].update_many(filter_dict, {"$set": data_dict})
+    return result.modified_count
+
+async def get_documents(
+    collection_name: str,
+    filter_dict: dict = None,
+    limit: int = None,
+    projection: dict = None,
+    sort: List[Tuple[str, int]] = None,
+):
+    """Get documents from collection, optionally projected and sorted"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
     
-    cursor = db[collection_name].find(filter_dict or {})
+    cursor = db[collection_name].find(filter_dict or {}, projection)
+    if sort:
+        cursor = cursor.sort(sort)
     if limit:
         cursor = cursor.limit(limit)
     
-    return list(cursor)
+    return await cursor.to_list(length=limit or None)
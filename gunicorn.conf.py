@@ -0,0 +1,27 @@
+"""
+Gunicorn configuration for production
+
+Runs the FastAPI app under UvicornWorker processes, one event loop each.
+Picked up automatically by `gunicorn main:app` from this directory (see start.sh).
+"""
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+
+# WEB_CONCURRENCY overrides the default of 2 * CPU + 1 workers
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Worker heartbeat timeout, not a per-request limit: the arbiter restarts a worker whose
+# event loop has been blocked or hung for this long
+timeout = 60
+# Time a worker gets to finish after SIGTERM (including max_requests recycling); the app's
+# shutdown drains its analysis queue within ANALYSIS_DRAIN_SECONDS, which must stay below this
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers periodically to cap memory growth
+max_requests = 10000
+max_requests_jitter = 500
@@ -1,17 +1,40 @@
-import os
-from typing import Optional
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 from passlib.context import CryptContext
-from database import db, create_document, get_documents
-from schemas import User, Meal
+from pymongo.errors import DuplicateKeyError
+from config import settings
+from database import db, create_document, get_document, get_documents, update_document, update_documents, ensure_indexes
+from schemas import Meal, UserAdapter, MealAdapter
+from cache import get_cached_analysis, set_cached_analysis
+import anyio
+import asyncio
 import base64
-import requests
+import hashlib
+import httpx
+import ijson
+import io
+import orjson
+import ssl
+import tempfile
+from PIL import Image, ImageOps
+from tenacity import (
+    AsyncRetrying,
+    retry_if_exception_type,
+    retry_if_result,
+    stop_after_attempt,
+    wait_random_exponential,
+)
+
+logger = logging.getLogger("uvicorn.error")
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # CORS: Use wildcard origins without credentials to avoid browser rejection
 # (Browsers block "*" with credentials=true). If you need cookies later, set a specific origin list and enable credentials.
@@ -23,6 +46,61 @@ app.add_middleware(
     allow_headers=["*"]
 )
 
+@app.on_event("startup")
+async def startup():
+    # Shared client so vision calls reuse pooled keep-alive (HTTP/2) connections
+    app.state.http = httpx.AsyncClient(
+        http2=True,
+        timeout=httpx.Timeout(20.0),
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+    )
+    config = settings()
+    logger.info(
+        "Settings: database=%s redis=%s vision=%s max_concurrency=%d max_upload_mb=%d",
+        "set" if config.database_url and config.database_name else "not set",
+        "set" if config.redis_url else "not set (in-process cache)",
+        config.openai_api_url if config.openai_api_key else "stub (no OPENAI_API_KEY)",
+        config.openai_max_concurrency,
+        config.max_upload_mb,
+    )
+    # hashlib's sha256 comes from OpenSSL, which uses SHA-NI/ARMv8 SHA instructions where available
+    logger.info("Image hashing: %s via %s", hashlib.sha256().name, ssl.OPENSSL_VERSION)
+    if db is not None:
+        await ensure_indexes()
+        # Persist failure for meals stranded by a worker that died without a clean shutdown
+        await update_documents(
+            "meal",
+            {"status": "processing", "updated_at": {"$lt": datetime.now(timezone.utc) - MEAL_PROCESSING_TIMEOUT}},
+            {"status": "failed", "error": STALE_MEAL_ERROR},
+        )
+    # Uploads are analyzed off the request path by a fixed pool of workers
+    app.state.analysis_queue = asyncio.Queue(maxsize=ANALYSIS_QUEUE_SIZE)
+    app.state.analysis_workers = [
+        asyncio.create_task(analysis_worker(app.state.analysis_queue))
+        for _ in range(ANALYSIS_WORKERS)
+    ]
+
+@app.on_event("shutdown")
+async def shutdown():
+    # Workers restart routinely (gunicorn max_requests), so give queued analyses a chance to
+    # finish within graceful_timeout, then fail whatever is left rather than strand it
+    queue = app.state.analysis_queue
+    try:
+        await asyncio.wait_for(queue.join(), timeout=ANALYSIS_DRAIN_SECONDS)
+    except asyncio.TimeoutError:
+        pass
+    # Cancelled workers mark their in-flight meal failed before exiting
+    for task in app.state.analysis_workers:
+        task.cancel()
+    await asyncio.gather(*app.state.analysis_workers, return_exceptions=True)
+    pending = []
+    while not queue.empty():
+        meal_id, image_file, _ = queue.get_nowait()
+        image_file.close()
+        pending.append(mark_meal_failed(meal_id, SHUTDOWN_MEAL_ERROR))
+    await asyncio.gather(*pending)
+    await app.state.http.aclose()
+
 class SignupRequest(BaseModel):
     name: str
     email: str
@@ -53,7 +131,7 @@ async def test_database():
             response["database_name"] = db.name if hasattr(db, 'name') else "✅ Connected"
             response["connection_status"] = "Connected"
             try:
-                collections = db.list_collection_names()
+                collections = await db.list_collection_names()
                 response["collections"] = collections[:10]
                 response["database"] = "✅ Connected & Working"
             except Exception as e:
@@ -63,42 +141,214 @@ async def test_database():
     except Exception as e:
         response["database"] = f"❌ Error: {str(e)[:50]}"
 
-    response["database_url"] = "✅ Set" if os.getenv("DATABASE_URL") else "❌ Not Set"
-    response["database_name"] = "✅ Set" if os.getenv("DATABASE_NAME") else "❌ Not Set"
+    response["database_url"] = "✅ Set" if settings().database_url else "❌ Not Set"
+    response["database_name"] = "✅ Set" if settings().database_name else "❌ Not Set"
     return response
 
 @app.post("/auth/signup")
 async def signup(payload: SignupRequest):
-    existing = list(db["user"].find({"email": payload.email})) if db else []
-    if existing:
+    # bcrypt is deliberately slow; keep it off the event loop
+    password_hash = await anyio.to_thread.run_sync(pwd_context.hash, payload.password)
+    user = UserAdapter.validate_python(
+        {"name": payload.name, "email": payload.email, "password_hash": password_hash, "is_active": True}
+    )
+    try:
+        user_id = await create_document("user", user)
+    except DuplicateKeyError:
         raise HTTPException(status_code=400, detail="Email already registered")
-    password_hash = pwd_context.hash(payload.password)
-    user = User(name=payload.name, email=payload.email, password_hash=password_hash, is_active=True)
-    user_id = create_document("user", user)
     return {"user_id": user_id}
 
 @app.post("/auth/login")
 async def login(payload: LoginRequest):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
-    doc = db["user"].find_one({"email": payload.email})
+    doc = await db["user"].find_one(
+        {"email": payload.email},
+        projection={"password_hash": 1, "name": 1, "email": 1},
+    )
     if not doc:
         raise HTTPException(status_code=401, detail="Invalid credentials")
-    if not pwd_context.verify(payload.password, doc.get("password_hash", "")):
+    ok = await anyio.to_thread.run_sync(pwd_context.verify, payload.password, doc.get("password_hash", ""))
+    if not ok:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     return {"user_id": str(doc.get("_id")), "name": doc.get("name"), "email": doc.get("email")}
 
 # Vision-based calorie estimation via OpenAI-compatible API (no key required in this environment)
 # We will use a placeholder-free approach: send the image as base64 to a generic /v1/chat/completions if available.
-# If OPENAI_API_KEY is not set, we'll fallback to a deterministic stub.
+# If OPENAI_API_KEY is not set, we'll fallback to a deterministic stub. Real failures raise so the meal is marked failed.
+
+# Static parts of the vision request, built once instead of per call
+VISION_MODEL = "gpt-4o-mini"
+_AUTH_HEADERS = {
+    "Authorization": f"Bearer {settings().openai_api_key}",
+    "Content-Type": "application/json"
+}
+_SYSTEM_MSG = {
+    "role": "system",
+    "content": "You are a nutrition analyst. Return a concise JSON answer with dish_name, calories (kcal), macros (carbs_g, protein_g, fat_g), and ingredients array."
+}
+_USER_TEXT_PART = {"type": "text", "text": "Estimate calories and macros for this meal."}
+_RESPONSE_FORMAT = {"type": "json_object"}
+
+# The request body is serialized once around a placeholder; each call splices the
+# base64 image bytes between the halves instead of re-serializing a large string.
+_IMAGE_URL_PLACEHOLDER = "__IMAGE_DATA_URL__"
+_BODY_HEAD, _BODY_TAIL = orjson.dumps({
+    "model": VISION_MODEL,
+    "messages": [
+        _SYSTEM_MSG,
+        {
+            "role": "user",
+            "content": [
+                _USER_TEXT_PART,
+                {"type": "image_url", "image_url": {"url": _IMAGE_URL_PLACEHOLDER}}
+            ]
+        }
+    ],
+    "response_format": _RESPONSE_FORMAT
+}).split(orjson.dumps(_IMAGE_URL_PLACEHOLDER))
+
+# Read size for streaming base64; a multiple of 3 so chunks encode without padding
+B64_CHUNK_SIZE = 57 * 1024
+
+# Uploads are downscaled before encoding; the vision model gains little above this size
+VISION_MAX_EDGE = 1024
+VISION_JPEG_QUALITY = 80
+# Decoded size is bounded by pixel count, not file size; a small PNG/WebP can expand to hundreds
+# of MB. Checked from the header before decoding (covers 48 MP phone photos).
+VISION_MAX_PIXELS = 50_000_000
+
+# Retry policy for the vision call: transient upstream statuses and network errors
+RETRY_STATUS_CODES = {429, 500, 502, 503, 529}
+VISION_MAX_ATTEMPTS = 5
+VISION_DEADLINE_SECONDS = 60
+
+# Caps in-flight upstream requests per worker process, independent of how many analyses are queued
+VISION_SEM = asyncio.Semaphore(settings().openai_max_concurrency)
+_backoff = wait_random_exponential(min=2, max=30)
+
+
+def _wait_for_retry(retry_state) -> float:
+    """Honor Retry-After from the upstream response, else exponential backoff with jitter"""
+    outcome = retry_state.outcome
+    if not outcome.failed:
+        resp, _ = outcome.result()
+        retry_after = resp.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return min(float(retry_after), 30)
+    return _backoff(retry_state)
+
+
+class _ResponseReader:
+    """Minimal async file-like view over a streamed httpx response, as ijson expects"""
+
+    def __init__(self, resp: httpx.Response):
+        self._chunks = resp.aiter_bytes()
+
+    async def read(self, size: int = -1) -> bytes:
+        # ijson probes with read(0) to detect bytes vs str; don't consume a chunk for it
+        if size == 0:
+            return b""
+        return await anext(self._chunks, b"")
+
+
+async def parse_completion(resp: httpx.Response) -> Tuple[Optional[str], dict]:
+    """Incrementally parse a chat completion, keeping only the first message content and a trimmed raw"""
+    content = None
+    raw = {"id": None, "model": None, "usage": {}}
+    async for prefix, event, value in ijson.parse_async(_ResponseReader(resp), use_float=True):
+        if prefix == "choices.item.message.content" and content is None:
+            content = value
+        elif prefix in ("id", "model") and event == "string":
+            raw[prefix] = value
+        elif prefix.startswith("usage.") and event == "number":
+            key = prefix[len("usage."):]
+            if "." not in key:
+                raw["usage"][key] = value
+    return content, raw
+
+
+async def _send_vision_request(url: str, **kwargs) -> Tuple[httpx.Response, Optional[Tuple[Optional[str], dict]]]:
+    """One attempt: stream the response and parse it on success, or read the (small) error body"""
+    client = app.state.http
+    # Held per attempt only, so backoff sleeps between retries don't occupy a slot
+    async with VISION_SEM:
+        resp = await client.send(client.build_request("POST", url, **kwargs), stream=True)
+        try:
+            if resp.status_code >= 400:
+                await resp.aread()
+                return resp, None
+            return resp, await parse_completion(resp)
+        finally:
+            await resp.aclose()
+
+
+async def post_with_retry(url: str, **kwargs) -> Tuple[httpx.Response, Optional[Tuple[Optional[str], dict]]]:
+    """POST via the shared client, retrying transient failures within an overall deadline.
+
+    Returns the last response and, when it succeeded, the parsed (content, raw) completion.
+    """
+    retrying = AsyncRetrying(
+        stop=stop_after_attempt(VISION_MAX_ATTEMPTS),
+        wait=_wait_for_retry,
+        retry=(
+            retry_if_exception_type((httpx.TimeoutException, httpx.TransportError))
+            | retry_if_result(lambda r: r[0].status_code in RETRY_STATUS_CODES)
+        ),
+        # Once attempts run out, hand back the last response (or raise its error)
+        retry_error_callback=lambda state: state.outcome.result(),
+    )
+    return await asyncio.wait_for(
+        retrying(_send_vision_request, url, **kwargs),
+        timeout=VISION_DEADLINE_SECONDS,
+    )
+
+
+def resize_image(file_obj) -> io.BytesIO:
+    """Downscale to VISION_MAX_EDGE on the long edge and re-encode as JPEG; CPU-bound, run off the loop"""
+    img = Image.open(file_obj)
+    if img.width * img.height > VISION_MAX_PIXELS:
+        raise ValueError(f"Image too large to decode: {img.width}x{img.height} pixels")
+    img = ImageOps.exif_transpose(img)
+    img.thumbnail((VISION_MAX_EDGE, VISION_MAX_EDGE), Image.Resampling.LANCZOS)
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=VISION_JPEG_QUALITY, optimize=True)
+    buf.seek(0)
+    return buf
 
-OPENAI_API_URL = os.getenv("OPENAI_API_URL", "https://api.openai.com/v1/chat/completions")
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
+def build_vision_payload(file_obj) -> bytes:
+    """Stream-encode a file-like JPEG into the serialized vision request body.
 
-def analyze_image_with_fallback(image_bytes: bytes):
+    Base64 output needs no JSON escaping, so it is written straight into the body bytes.
+    """
+    out = bytearray(_BODY_HEAD)
+    out.extend(b'"data:image/jpeg;base64,')
+    while chunk := file_obj.read(B64_CHUNK_SIZE):
+        out.extend(base64.b64encode(chunk))
+    out.extend(b'"')
+    out.extend(_BODY_TAIL)
+    return bytes(out)
+
+
+def validate_analysis(analysis: dict) -> Meal:
+    """Validate an analysis against the Meal schema; raises ValidationError on bad model output"""
+    return MealAdapter.validate_python({
+        "dish_name": analysis.get("dish_name"),
+        "calories": analysis.get("calories"),
+        "macros": analysis.get("macros"),
+        "ingredients": analysis.get("ingredients"),
+        "raw_response": analysis.get("raw"),
+        "status": "done",
+    })
+
+
+async def analyze_image_file(file_obj, image_hash: str):
+    """Estimate calories for an image; raises on any upstream, decode or parse failure"""
     # If no key, return a simple stub for demo purposes
-    if not OPENAI_API_KEY:
+    if not settings().openai_api_key:
         return {
             "dish_name": "Mixed meal",
             "calories": 520,
@@ -107,82 +357,187 @@ def analyze_image_with_fallback(image_bytes: bytes):
             "raw": {"provider": "stub"}
         }
 
+    # Keyed on the original upload's hash so hits skip the resize as well
+    cached = await get_cached_analysis(image_hash)
+    if cached is not None:
+        return cached
+    resized = await anyio.to_thread.run_sync(resize_image, file_obj)
+    payload = build_vision_payload(resized)
+    resp, completion = await post_with_retry(settings().openai_api_url, headers=_AUTH_HEADERS, content=payload)
+    if resp.status_code >= 400:
+        raise Exception(f"Vision API error: {resp.status_code} {resp.text[:120]}")
+    content, raw = completion
+    if not content:
+        raise Exception("Vision API returned no message content")
+    parsed = orjson.loads(content)
+    if not isinstance(parsed, dict):
+        raise Exception(f"Vision API returned non-object JSON: {content[:120]}")
+    analysis = {
+        "dish_name": parsed.get("dish_name"),
+        "calories": parsed.get("calories"),
+        "macros": parsed.get("macros"),
+        "ingredients": parsed.get("ingredients"),
+        "raw": raw
+    }
+    # Only answers that pass Meal validation are cached; a bad one must not pin re-uploads to failure
+    validate_analysis(analysis)
+    await set_cached_analysis(image_hash, analysis)
+    return analysis
+
+# Background analysis: /analyze stores a "processing" meal and queues the image;
+# workers run the vision call and patch the meal when it completes.
+ANALYSIS_WORKERS = 10
+ANALYSIS_QUEUE_SIZE = 200
+# Hard cap per job (vision deadline plus hashing, resize and DB time), so jobs always finish
+ANALYSIS_JOB_SECONDS = VISION_DEADLINE_SECONDS + 15
+# Longest a meal can legitimately stay "processing": waiting behind a full queue, then running.
+# Older ones were stranded by a dead worker and are reported (and swept at startup) as failed.
+MEAL_PROCESSING_TIMEOUT = timedelta(
+    seconds=(ANALYSIS_QUEUE_SIZE // ANALYSIS_WORKERS + 1) * ANALYSIS_JOB_SECONDS
+)
+# Kept below gunicorn's graceful_timeout (gunicorn.conf.py) to leave time to fail leftovers
+ANALYSIS_DRAIN_SECONDS = 20
+SHUTDOWN_MEAL_ERROR = "Interrupted by server shutdown"
+STALE_MEAL_ERROR = "Analysis did not complete"
+# Queued images stay in memory up to this size, then spill to disk. Waiting jobs therefore
+# pin at most ANALYSIS_QUEUE_SIZE * UPLOAD_SPOOL_SIZE (~12.5 MiB) of RAM per worker process;
+# larger uploads wait on disk (up to ANALYSIS_QUEUE_SIZE * MAX_UPLOAD_MB).
+UPLOAD_SPOOL_SIZE = 64 * 1024
+MAX_UPLOAD_BYTES = settings().max_upload_mb * 1024 * 1024
+ANALYSIS_FIELDS = {"dish_name", "calories", "macros", "ingredients", "raw_response", "status"}
+
+
+SUPPORTED_IMAGE_TYPES = {"image/jpeg", "image/png", "image/webp"}
+
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """Detect a supported image type from the first 12 bytes of the file"""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def spool_upload(file_obj) -> Tuple[tempfile.SpooledTemporaryFile, str]:
+    """Copy an upload into a temp file owned by the analysis job; the request closes its own.
+
+    Returns the copy and the upload's SHA-256 hex digest, computed in the same pass.
+    Raises 413 as soon as the running total passes MAX_UPLOAD_BYTES.
+    """
+    spooled = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_SIZE)
+    digest = hashlib.sha256()
+    total = 0
+    while chunk := file_obj.read(B64_CHUNK_SIZE):
+        total += len(chunk)
+        if total > MAX_UPLOAD_BYTES:
+            spooled.close()
+            raise HTTPException(status_code=413, detail="File too large")
+        digest.update(chunk)
+        spooled.write(chunk)
+    spooled.seek(0)
+    return spooled, digest.hexdigest()
+
+
+async def mark_meal_failed(meal_id: str, error: str):
+    """Record a failed analysis; the reason goes in `error`, which listings always return"""
     try:
-        img_b64 = base64.b64encode(image_bytes).decode("utf-8")
-        headers = {
-            "Authorization": f"Bearer {OPENAI_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        body = {
-            "model": "gpt-4o-mini",
-            "messages": [
-                {
-                    "role": "system",
-                    "content": "You are a nutrition analyst. Return a concise JSON answer with dish_name, calories (kcal), macros (carbs_g, protein_g, fat_g), and ingredients array."
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": "Estimate calories and macros for this meal."},
-                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{img_b64}"}}
-                    ]
-                }
-            ],
-            "response_format": {"type": "json_object"}
-        }
-        resp = requests.post(OPENAI_API_URL, headers=headers, json=body, timeout=20)
-        if resp.status_code >= 400:
-            raise Exception(f"Vision API error: {resp.status_code} {resp.text[:120]}")
-        data = resp.json()
-        content = data.get("choices", [{}])[0].get("message", {}).get("content", "{}")
-        import json
-        parsed = json.loads(content)
-        return {
-            "dish_name": parsed.get("dish_name"),
-            "calories": parsed.get("calories"),
-            "macros": parsed.get("macros"),
-            "ingredients": parsed.get("ingredients"),
-            "raw": data
-        }
-    except Exception as e:
-        # On any failure, return a simple fallback
-        return {
-            "dish_name": "Meal",
-            "calories": 450,
-            "macros": {"carbs_g": 50, "protein_g": 20, "fat_g": 18},
-            "ingredients": None,
-            "raw": {"error": str(e)}
-        }
+        await update_document("meal", meal_id, {"status": "failed", "error": error})
+    except Exception:
+        pass
+
+
+async def analysis_worker(queue: asyncio.Queue):
+    while True:
+        meal_id, image_file, image_hash = await queue.get()
+        try:
+            analysis = await asyncio.wait_for(
+                analyze_image_file(image_file, image_hash), timeout=ANALYSIS_JOB_SECONDS
+            )
+            meal = validate_analysis(analysis)
+            update = MealAdapter.dump_python(meal, mode="json", include=ANALYSIS_FIELDS, exclude_none=True)
+            await update_document("meal", meal_id, update)
+        except asyncio.CancelledError:
+            await mark_meal_failed(meal_id, SHUTDOWN_MEAL_ERROR)
+            raise
+        except Exception as e:
+            # No placeholder numbers: pollers see status="failed" and the reason
+            await mark_meal_failed(meal_id, f"{type(e).__name__}: {e}" if str(e) else type(e).__name__)
+        finally:
+            image_file.close()
+            queue.task_done()
+
 
-@app.post("/analyze", summary="Analyze a food image and estimate calories")
-async def analyze_image(file: UploadFile = File(...), user_id: Optional[str] = Form(None)):
-    image_bytes = await file.read()
-    analysis = analyze_image_with_fallback(image_bytes)
-
-    meal_doc = Meal(
-        user_id=user_id,
-        image_name=file.filename,
-        dish_name=analysis.get("dish_name"),
-        calories=analysis.get("calories"),
-        macros=analysis.get("macros"),
-        ingredients=analysis.get("ingredients"),
-        raw_response=analysis.get("raw"),
+def serialize_meal(m: dict) -> dict:
+    # A dead worker's meals never get a final write; report them failed once past any legitimate wait
+    updated_at = m.get("updated_at")
+    if m.get("status") == "processing" and updated_at:
+        if updated_at.tzinfo is None:
+            updated_at = updated_at.replace(tzinfo=timezone.utc)  # Mongo returns naive UTC
+        if datetime.now(timezone.utc) - updated_at > MEAL_PROCESSING_TIMEOUT:
+            m["status"] = "failed"
+            m["error"] = STALE_MEAL_ERROR
+    # Convert ObjectId to string
+    m["_id"] = str(m["_id"]) if "_id" in m else None
+    if m.get("created_at"):
+        m["created_at"] = str(m["created_at"])  # simple serialization
+    return m
+
+
+@app.post("/analyze", status_code=202, summary="Queue a food image for calorie estimation")
+async def analyze_image(response: Response, file: UploadFile = File(...), user_id: Optional[str] = Form(None)):
+    # Reject unsupported uploads before spending any work on them; clients often send
+    # application/octet-stream, so fall back to the file signature
+    if file.size is not None and file.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="File too large")
+    mime = file.content_type
+    if mime not in SUPPORTED_IMAGE_TYPES:
+        mime = sniff_image_type(await file.read(12))
+        await file.seek(0)
+    if mime is None:
+        raise HTTPException(status_code=415, detail="Unsupported image type; use JPEG, PNG or WebP")
+
+    queue = app.state.analysis_queue
+    if queue.full():
+        raise HTTPException(status_code=503, detail="Analysis queue is full, try again later")
+
+    image_file, image_hash = await anyio.to_thread.run_sync(spool_upload, file.file)
+    meal_doc = MealAdapter.validate_python(
+        {"user_id": user_id, "image_name": file.filename, "status": "processing"}
     )
-    meal_id = create_document("meal", meal_doc)
-    return {"meal_id": meal_id, **analysis}
+    try:
+        meal_id = await create_document("meal", meal_doc)
+        queue.put_nowait((meal_id, image_file, image_hash))
+    except asyncio.QueueFull:
+        image_file.close()
+        await mark_meal_failed(meal_id, "Analysis queue is full")
+        raise HTTPException(status_code=503, detail="Analysis queue is full, try again later")
+    except Exception:
+        image_file.close()
+        raise
+    # Identifies the image content, so clients can recognise re-uploads of the same photo
+    response.headers["ETag"] = f'W/"{image_hash}"'
+    return {"meal_id": meal_id, "status": "processing"}
 
 @app.get("/meals")
-async def list_meals(user_id: Optional[str] = None, limit: int = 20):
+async def list_meals(user_id: Optional[str] = None, limit: int = 20, include_raw: bool = False):
     filter_dict = {"user_id": user_id} if user_id else {}
-    meals = get_documents("meal", filter_dict, limit)
-    # Convert ObjectId to string
-    for m in meals:
-        m["_id"] = str(m["_id"]) if "_id" in m else None
-        if m.get("created_at"):
-            m["created_at"] = str(m["created_at"])  # simple serialization
-    return meals
+    # raw_response holds the full upstream payload; only send it when asked for
+    projection = None if include_raw else {"raw_response": 0}
+    meals = await get_documents("meal", filter_dict, limit, projection=projection, sort=[("created_at", -1)])
+    return [serialize_meal(m) for m in meals]
+
+@app.get("/meals/{meal_id}")
+async def get_meal(meal_id: str, include_raw: bool = False):
+    projection = None if include_raw else {"raw_response": 0}
+    meal = await get_document("meal", meal_id, projection=projection)
+    if meal is None:
+        raise HTTPException(status_code=404, detail="Meal not found")
+    return serialize_meal(meal)
 
+# Single-process dev server; production runs multiple workers via start.sh (gunicorn)
 if __name__ == "__main__":
     import uvicorn
-    port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    uvicorn.run(app, host="0.0.0.0", port=settings().port)
@@ -7,7 +7,7 @@ Collection name is the lowercase of the class name.
 - User -> "user"
 - Meal -> "meal"
 """
-from pydantic import BaseModel, Field, EmailStr
+from pydantic import BaseModel, Field, EmailStr, TypeAdapter
 from typing import Optional, List, Dict
 
 class User(BaseModel):
@@ -30,4 +30,10 @@ class Meal(BaseModel):
     ingredients: Optional[List[str]] = None
     notes: Optional[str] = None
     source: Optional[str] = Field("openai-vision", description="Analyzer model/provider used")
+    status: str = Field("done", description="Analysis state: processing, done or failed")
+    error: Optional[str] = Field(None, description="Why analysis failed, when status is failed")
     raw_response: Optional[Dict] = None
+
+# Built once at import and reused for validating/dumping plain dicts on hot paths
+UserAdapter = TypeAdapter(User)
+MealAdapter = TypeAdapter(Meal)
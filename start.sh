@@ -0,0 +1,4 @@
+#!/bin/bash
+# Production entrypoint: gunicorn with UvicornWorker, configured by gunicorn.conf.py
+# Set WEB_CONCURRENCY to override the worker count.
+exec gunicorn main:app -c gunicorn.conf.py